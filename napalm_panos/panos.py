@@ -15,15 +15,17 @@ from __future__ import unicode_literals
 
 # std libs
 import xmltodict
-import json
 import pan.xapi
 import os.path
-import xml.etree
+import xml.etree.ElementTree
 import requests
 import requests_toolbelt
+from requests.adapters import HTTPAdapter
 from pkg_resources import parse_version
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import time
 import re
 
@@ -49,8 +51,47 @@ except ImportError:
 from netmiko import ConnectHandler
 from netmiko import __version__ as netmiko_version
 
+# Sub-interfaces, which have no entry of their own in the 'hw' table.
+_SUBIF_PATTERN = re.compile(
+    r"(ethernet\d+/\d+\.\d+)|(ae\d+\.\d+)|(loopback\.)|(tunnel\.)|(vlan\.)"
+)
+
+# Job id announced by the CLI 'commit' output, e.g. "Commit job 42 is in progress".
+_JOB_ID_PATTERN = re.compile(r"job\s+(\d+)", re.IGNORECASE)
+
+# Route flag letter -> protocol, as reported by <show><routing><route>.
+_PROTO_MAP = {
+    "C": "connect",
+    "S": "static",
+    "R": "rip",
+    "O": "ospf",
+    "B": "bgp",
+    "H": "host",
+}
+
+# Defaults of a get_route_to entry, copied for every route.
+_ROUTE_TEMPLATE = {
+    "current_active": False,
+    "last_active": False,
+    "age": -1,
+    "next_hop": "",
+    "protocol": "",
+    "outgoing_interface": "",
+    "preference": -1,
+    "inactive_reason": "",
+    "routing_table": "default",
+    "selected_next_hop": False,
+    "protocol_attributes": {},
+}
+
 
 class PANOSDriver(NetworkDriver):
+    # Per-interface show command, concatenated by _fetch_interface_hw.
+    _SHOW_INT_PREFIX = "<show><interface>"
+    _SHOW_INT_SUFFIX = "</interface></show>"
+    # Seconds during which a backup of an uncommitted-to running config is reused.
+    _BACKUP_MAX_AGE = 60
+
     def __init__(self, hostname, username, password, timeout=60, optional_args=None):
         self.hostname = hostname
         self.username = username
@@ -61,7 +102,10 @@ class PANOSDriver(NetworkDriver):
         self.device = None
         self.ssh_device = None
         self.ssh_connection = False
+        self.ssh_config_mode = False
         self.merge_config = False
+        self.backup_file = None
+        self._backup_written_at = None
 
         if optional_args is None:
             optional_args = {}
@@ -76,6 +120,7 @@ class PANOSDriver(NetworkDriver):
             "alt_host_keys": False,
             "alt_key_file": "",
             "ssh_config_file": None,
+            "keepalive": 30,
         }
 
         if parse_version(netmiko_version) >= parse_version("2.0.0"):
@@ -90,9 +135,31 @@ class PANOSDriver(NetworkDriver):
                 self.netmiko_optional_args[k] = optional_args[k]
             except KeyError:
                 pass
+        # Keep the SSH session from being dropped while idle, so it can be
+        # reused by every compare/merge/commit/rollback until close().
+        self.netmiko_optional_args.setdefault("keepalive", 30)
         self.api_key = optional_args.get("api_key", "")
+        self._cached_key = None
+
+        # Opt-in cache of the <show><interface>all</interface></show> output,
+        # reused by get_facts/get_interfaces/get_interfaces_ip until the running
+        # config changes or the session is closed.
+        self.cache_interfaces = optional_args.get("cache_interfaces", False)
+        self._iflist_cache = None
+        self._iflist_raw_cache = None
+
+        # Number of concurrent per-interface queries issued by get_interfaces.
+        self.interface_workers = optional_args.get("interface_workers", 1)
+
+        # Long-lived HTTP session so config imports reuse the TLS connection.
+        self._http = requests.Session()
+        self._http.mount(
+            "https://", HTTPAdapter(pool_connections=4, pool_maxsize=10)
+        )
+        self._http.headers.update({"Connection": "keep-alive"})
 
     def open(self):
+        requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
         try:
             if self.api_key:
                 self.device = pan.xapi.PanXapi(
@@ -120,37 +187,52 @@ class PANOSDriver(NetworkDriver):
             raise ConnectionException(str(e))
 
         self.ssh_connection = True
+        self.ssh_config_mode = False
 
     def close(self):
         self.device = None
+        self._cached_key = None
+        self._backup_written_at = None
+        self._invalidate_interface_cache()
+        self._http.close()
         if self.ssh_connection:
             self.ssh_device.disconnect()
             self.ssh_connection = False
+            self.ssh_config_mode = False
             self.ssh_device = None
 
+    def _get_api_key(self):
+        if self.api_key:
+            return self.api_key
+        if self._cached_key is None:
+            self._cached_key = self.device.keygen()
+        return self._cached_key
+
+    def _new_device(self):
+        """Return a new PanXapi instance sharing this session's API key."""
+        return pan.xapi.PanXapi(hostname=self.hostname, api_key=self._get_api_key())
+
     def _import_file(self, filename):
-        if not self.api_key:
-            key = self.device.keygen()
-        else:
-            key = self.api_key
+        key = self._get_api_key()
 
         params = {"type": "import", "category": "configuration", "key": key}
 
         path = os.path.basename(filename)
 
-        mef = requests_toolbelt.MultipartEncoder(
-            fields={"file": (path, open(filename, "rb"), "application/octet-stream")}
-        )
-
-        requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
         url = "https://{0}/api/".format(self.hostname)
-        request = requests.post(
-            url,
-            verify=False,
-            params=params,
-            headers={"Content-Type": mef.content_type},
-            data=mef,
-        )
+        with open(filename, "rb") as fh:
+            # MultipartEncoder reads the file in chunks while sending the body,
+            # so the config is never held in memory as a whole.
+            mef = requests_toolbelt.MultipartEncoder(
+                fields={"file": (path, fh, "application/octet-stream")}
+            )
+            request = self._http.post(
+                url,
+                verify=False,
+                params=params,
+                headers={"Content-Type": mef.content_type},
+                data=mef,
+            )
 
         # if something goes wrong just raise an exception
         request.raise_for_status()
@@ -210,7 +292,7 @@ class PANOSDriver(NetworkDriver):
             )
         return content
 
-    def _send_merge_commands(self, config, file_config):
+    def _send_merge_commands(self, config):
         """
         Netmiko is being used to push set commands.
         """
@@ -220,25 +302,30 @@ class PANOSDriver(NetworkDriver):
         if self.ssh_connection is False:
             self._open_ssh()
 
-        if isinstance(config, str):
-            if file_config:
-                config = config.splitlines()
-            else:
-                config = str(config).splitlines()
+        if isinstance(config, py23_compat.string_types):
+            config = config.splitlines()
 
-        self.ssh_device.send_config_set(config)
+        send_kwargs = {"exit_config_mode": False}
+        if parse_version(netmiko_version) >= parse_version("3.0.0"):
+            # Skip the per-line echo check, which dominates on large merges.
+            send_kwargs["cmd_verify"] = False
+
+        # Config mode is left on, compare_config exits it when needed.
+        self.ssh_config_mode = True
+        self.ssh_device.send_config_set(config, **send_kwargs)
         self.loaded = True
         self.merge_config = True
 
-    def _get_candidate(self):
+    def _get_candidate(self, device=None):
+        device = device or self.device
         candidate_command = "<show><config><candidate></candidate></config></show>"
-        self.device.op(cmd=candidate_command)
-        candidate = str(self.device.xml_root())
+        device.op(cmd=candidate_command)
+        candidate = device.xml_root()
         return candidate
 
     def _get_running(self):
         self.device.show()
-        running = str(self.device.xml_root())
+        running = self.device.xml_root()
         return running
 
     def get_config(self, retrieve="all", full=False):
@@ -256,8 +343,16 @@ class PANOSDriver(NetworkDriver):
         startup = py23_compat.text_type("")
 
         if retrieve == "all":
-            running = py23_compat.text_type(self._get_running())
-            candidate = py23_compat.text_type(self._get_candidate())
+            # Both configs are independent, fetch them concurrently. PanXapi
+            # is not thread-safe, so the candidate uses its own instance.
+            candidate_device = self._new_device()
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                running_future = executor.submit(self._get_running)
+                candidate_future = executor.submit(
+                    self._get_candidate, candidate_device
+                )
+            running = py23_compat.text_type(running_future.result())
+            candidate = py23_compat.text_type(candidate_future.result())
         elif retrieve == "running":
             running = py23_compat.text_type(self._get_running())
         elif retrieve == "candidate":
@@ -271,14 +366,10 @@ class PANOSDriver(NetworkDriver):
 
     def load_merge_candidate(self, filename=None, config=None):
         if filename:
-            file_config = True
-            content = self._get_file_content(filename)
-            config = content.splitlines()
-            self._send_merge_commands(config, file_config)
+            self._send_merge_commands(self._get_file_content(filename))
 
         elif config:
-            file_config = False
-            self._send_merge_commands(config, file_config)
+            self._send_merge_commands(config)
 
         else:
             raise MergeConfigException(
@@ -293,20 +384,32 @@ class PANOSDriver(NetworkDriver):
         if self.ssh_connection is False:
             self._open_ssh()
 
-        self.ssh_device.exit_config_mode()
+        if self.ssh_config_mode:
+            self.ssh_device.exit_config_mode()
+            self.ssh_config_mode = False
         diff = self.ssh_device.send_command("show config diff")
         return diff.strip()
 
     def _save_backup(self):
-        self.backup_file = "config_{0}.xml".format(
-            str(datetime.now().date()).replace(" ", "_")
-        )
+        now = datetime.now()
+        backup_file = "config_{0}.xml".format(str(now.date()).replace(" ", "_"))
+        if (
+            self._backup_written_at is not None
+            and backup_file == self.backup_file
+            and (now - self._backup_written_at).total_seconds() < self._BACKUP_MAX_AGE
+        ):
+            # Nothing was committed since this backup was saved, it still
+            # matches the running config.
+            return True
+
+        self.backup_file = backup_file
         backup_command = "<save><config><to>{0}</to></config></save>".format(
             self.backup_file
         )
 
         self.device.op(cmd=backup_command)
         if self.device.status == "success":
+            self._backup_written_at = now
             return True
         else:
             return False
@@ -323,11 +426,14 @@ class PANOSDriver(NetworkDriver):
         if self.loaded:
             if self.ssh_connection is False:
                 self._open_ssh()
+            # netmiko's commit() enters config mode and stays there.
+            self.ssh_config_mode = True
             try:
-                self.ssh_device.commit()
-                time.sleep(3)
+                self._wait_for_job(self.ssh_device.commit())
                 self.loaded = False
                 self.changed = True
+                self._backup_written_at = None
+                self._invalidate_interface_cache()
             except:  # noqa
                 if self.merge_config:
                     raise MergeConfigException("Error while commiting config")
@@ -336,6 +442,29 @@ class PANOSDriver(NetworkDriver):
         else:
             raise ReplaceConfigException("No config loaded.")
 
+    def _wait_for_job(self, output):
+        """Poll the job announced in output until the device reports it finished."""
+        match = _JOB_ID_PATTERN.search(output or "")
+        if not match:
+            # Nothing was queued, e.g. there were no changes to commit.
+            return
+
+        job_id = match.group(1)
+        cmd = "<show><jobs><id>{0}</id></jobs></show>".format(job_id)
+        deadline = time.time() + self.timeout
+        delay = 0.1
+        while True:
+            self.device.op(cmd=cmd)
+            job = xmltodict.parse(self.device.xml_root())["response"]["result"]["job"]
+            if job.get("status") == "FIN":
+                if job.get("result") == "FAIL":
+                    raise RuntimeError("Job {0} failed".format(job_id))
+                return
+            if time.time() >= deadline:
+                raise RuntimeError("Timed out waiting for job {0}".format(job_id))
+            time.sleep(delay)
+            delay = min(delay * 1.5, 2)
+
     def discard_config(self):
         if self.loaded:
             discard_cmd = "<load><config><from>{0}</from></config></load>".format(
@@ -346,6 +475,7 @@ class PANOSDriver(NetworkDriver):
             if self.device.status == "success":
                 self.loaded = False
                 self.merge_config = False
+                self._invalidate_interface_cache()
             else:
                 raise ReplaceConfigException("Error while loading backup config.")
 
@@ -359,23 +489,78 @@ class PANOSDriver(NetworkDriver):
                 self.backup_file
             )
             self.device.op(cmd=rollback_cmd)
-            time.sleep(5)
 
             if self.ssh_connection is False:
                 self._open_ssh()
+            # netmiko's commit() enters config mode and stays there.
+            self.ssh_config_mode = True
             try:
-                self.ssh_device.commit()
+                self._wait_for_job(self.ssh_device.commit())
                 self.loaded = False
                 self.changed = False
                 self.merge_config = False
+                self._backup_written_at = None
+                self._invalidate_interface_cache()
             except:  # noqa
                 ReplaceConfigException("Error while loading backup config")
 
-    def _extract_interface_list(self):
+    def _fetch_interface_hw(self, device, intf):
+        """Return the 'hw' section of a single interface, None for sub-ifs."""
+        device.op(cmd=self._SHOW_INT_PREFIX + intf + self._SHOW_INT_SUFFIX)
+        try:
+            return xmltodict.parse(device.xml_root())["response"]["result"]["hw"]
+        except KeyError as err:
+            if _SUBIF_PATTERN.search(intf) and "hw" in str(err):
+                # physical/ae/tunnel/loopback sub-ifs don't return a 'hw' key
+                return None
+            raise
+
+    def _get_interfaces_hw(self, interface_list):
+        """
+        Query the 'hw' section of every interface in interface_list.
+
+        With interface_workers > 1 the queries run concurrently, each worker
+        thread using its own PanXapi instance as those are not thread-safe.
+        """
+        if self.interface_workers <= 1 or len(interface_list) <= 1:
+            return {
+                intf: self._fetch_interface_hw(self.device, intf)
+                for intf in interface_list
+            }
+
+        # Generate the key once, before the worker threads need it.
+        self._get_api_key()
+        local = threading.local()
+
+        def fetch(intf):
+            if not hasattr(local, "device"):
+                local.device = self._new_device()
+            return self._fetch_interface_hw(local.device, intf)
+
+        with ThreadPoolExecutor(max_workers=self.interface_workers) as executor:
+            return dict(zip(interface_list, executor.map(fetch, interface_list)))
+
+    def _invalidate_interface_cache(self):
+        self._iflist_cache = None
+        self._iflist_raw_cache = None
+
+    def _get_interfaces_all(self):
+        if self.cache_interfaces and self._iflist_raw_cache is not None:
+            return self._iflist_raw_cache
+
         self.device.op(cmd="<show><interface>all</interface></show>")
-        interfaces_xml = xmltodict.parse(self.device.xml_root())
-        interfaces_json = json.dumps(interfaces_xml["response"]["result"])
-        interfaces = json.loads(interfaces_json)
+        interfaces = xmltodict.parse(self.device.xml_root())["response"]["result"]
+
+        if self.cache_interfaces:
+            self._iflist_raw_cache = interfaces
+        return interfaces
+
+    def _extract_interface_list(self, interfaces=None):
+        if self.cache_interfaces and self._iflist_cache is not None:
+            return list(self._iflist_cache)
+
+        if interfaces is None:
+            interfaces = self._get_interfaces_all()
 
         interface_set = set()
 
@@ -388,6 +573,8 @@ class PANOSDriver(NetworkDriver):
                 for intf in entry_contents:
                     interface_set.add(intf["name"])
 
+        if self.cache_interfaces:
+            self._iflist_cache = list(interface_set)
         return list(interface_set)
 
     def get_facts(self):
@@ -396,10 +583,7 @@ class PANOSDriver(NetworkDriver):
         try:
             self.device.op(cmd="<show><system><info></info></system></show>")
             system_info_xml = xmltodict.parse(self.device.xml_root())
-            system_info_json = json.dumps(
-                system_info_xml["response"]["result"]["system"]
-            )
-            system_info = json.loads(system_info_json)
+            system_info = system_info_xml["response"]["result"]["system"]
         except AttributeError:
             system_info = {}
 
@@ -426,8 +610,7 @@ class PANOSDriver(NetworkDriver):
         try:
             self.device.op(cmd=cmd)
             lldp_table_xml = xmltodict.parse(self.device.xml_root())
-            lldp_table_json = json.dumps(lldp_table_xml["response"]["result"]["entry"])
-            lldp_table = json.loads(lldp_table_json)
+            lldp_table = lldp_table_xml["response"]["result"]["entry"]
         except AttributeError:
             lldp_table = []
 
@@ -439,9 +622,7 @@ class PANOSDriver(NetworkDriver):
         for lldp_item in lldp_table:
 
             local_int = lldp_item["@name"]
-
-            if local_int not in neighbors.keys():
-                neighbors[local_int] = []
+            local_neighbors = neighbors.setdefault(local_int, [])
             try:
                 lldp_neighs = lldp_item.get("neighbors").get("entry")
             except AttributeError:
@@ -453,7 +634,7 @@ class PANOSDriver(NetworkDriver):
                 n = {}
                 n["hostname"] = neighbor["system-name"]
                 n["port"] = neighbor["port-id"]
-                neighbors[local_int].append(n)
+                local_neighbors.append(n)
         return neighbors
 
     def get_route_to(self, destination="", protocol=""):
@@ -472,68 +653,40 @@ class PANOSDriver(NetworkDriver):
         cmd = "<show><routing><route>{0}{1}</route></routing></show>".format(
             protocol, destination
         )
-        try:
-            self.device.op(cmd=cmd)
-            routes_table_xml = xmltodict.parse(self.device.xml_root())
-            routes_table_json = json.dumps(
-                routes_table_xml["response"]["result"]["entry"]
-            )
-            routes_table = json.loads(routes_table_json)
-        except (AttributeError, KeyError):
-            routes_table = []
-
-        if isinstance(routes_table, dict):
-            routes_table = [routes_table]
-
-        for route in routes_table:
-            d = {
-                "current_active": False,
-                "last_active": False,
-                "age": -1,
-                "next_hop": "",
-                "protocol": "",
-                "outgoing_interface": "",
-                "preference": -1,
-                "inactive_reason": "",
-                "routing_table": "default",
-                "selected_next_hop": False,
-                "protocol_attributes": {},
-            }
-            destination = route["destination"]
-            flags = route["flags"]
-
-            if "A" in flags:
-                d["current_active"] = True
-            else:
-                d["current_active"] = False
-            if "C" in flags:
-                d["protocol"] = "connect"
-            if "S" in flags:
-                d["protocol"] = "static"
-            if "R" in flags:
-                d["protocol"] = "rip"
-            if "R" in flags:
-                d["protocol"] = "rip"
-            if "O" in flags:
-                d["protocol"] = "ospf"
-            if "B" in flags:
-                d["protocol"] = "bgp"
-            if "H" in flags:
-                d["protocol"] = "host"
-            if route["age"] is not None:
-                d["age"] = int(route["age"])
-            if route["nexthop"] is not None:
-                d["next_hop"] = route["nexthop"]
-            if route["interface"] is not None:
-                d["outgoing_interface"] = route["interface"]
-            if route["metric"] is not None:
-                d["preference"] = int(route["metric"])
-            if route["virtual-router"] is not None:
-                d["routing_table"] = route["virtual-router"]
-
-            if destination not in routes.keys():
-                routes[destination] = []
-            routes[destination].append(d)
+        self.device.op(cmd=cmd)
+        # Walk the tree PanXapi already parsed rather than serializing it back
+        # to text and parsing it a second time.
+        routes_root = self.device.element_root
+        if routes_root is None:
+            return routes
+
+        for route in routes_root.iterfind("result/entry"):
+            d = _ROUTE_TEMPLATE.copy()
+            d["protocol_attributes"] = {}
+            destination = (route.findtext("destination") or "").strip()
+            flags = route.findtext("flags") or ""
+
+            d["current_active"] = "A" in flags
+            for flag in flags:
+                if flag in _PROTO_MAP:
+                    d["protocol"] = _PROTO_MAP[flag]
+            age = (route.findtext("age") or "").strip()
+            if age:
+                d["age"] = int(age)
+            nexthop = (route.findtext("nexthop") or "").strip()
+            if nexthop:
+                d["next_hop"] = nexthop
+            interface = (route.findtext("interface") or "").strip()
+            if interface:
+                d["outgoing_interface"] = interface
+            metric = (route.findtext("metric") or "").strip()
+            if metric:
+                d["preference"] = int(metric)
+            virtual_router = (route.findtext("virtual-router") or "").strip()
+            if virtual_router:
+                d["routing_table"] = virtual_router
+
+            routes.setdefault(destination, []).append(d)
 
         return routes
 
@@ -547,29 +700,30 @@ class PANOSDriver(NetworkDriver):
             "mtu": 0,
             "description": "N/A",
         }
-        interface_pattern = re.compile(
-            r"(ethernet\d+/\d+\.\d+)|(ae\d+\.\d+)|(loopback\.)|(tunnel\.)|(vlan\.)"
-        )
         interface_dict = {}
-        interface_list = self._extract_interface_list()
+        interfaces_all = self._get_interfaces_all()
+        interface_list = self._extract_interface_list(interfaces_all)
+
+        hw_entries = (interfaces_all.get("hw") or {}).get("entry", [])
+        if isinstance(hw_entries, dict):
+            hw_entries = [hw_entries]
+        hw_names = set(entry["name"] for entry in hw_entries)
+
+        # sub-ifs are not listed in the 'hw' table, no need to query them
+        hw_list = [
+            intf
+            for intf in interface_list
+            if intf in hw_names or not _SUBIF_PATTERN.search(intf)
+        ]
+        hw_info = self._get_interfaces_hw(hw_list)
 
         for intf in interface_list:
-            interface = {}
-            cmd = "<show><interface>{0}</interface></show>".format(intf)
+            interface_info = hw_info.get(intf)
+            if interface_info is None:
+                interface_dict[intf] = SUBIF_DEFAULTS
+                continue
 
-            try:
-                self.device.op(cmd=cmd)
-                interface_info_xml = xmltodict.parse(self.device.xml_root())
-                interface_info_json = json.dumps(
-                    interface_info_xml["response"]["result"]["hw"]
-                )
-                interface_info = json.loads(interface_info_json)
-            except KeyError as err:
-                if interface_pattern.search(intf) and "hw" in str(err):
-                    # physical/ae/tunnel/loopback sub-ifs don't return a 'hw' key
-                    interface_dict[intf] = SUBIF_DEFAULTS
-                    continue
-                raise
+            interface = {}
 
             interface["is_up"] = interface_info.get("state") == "up"
 
@@ -685,14 +839,7 @@ class PANOSDriver(NetworkDriver):
             return _ip_info
 
         ip_interfaces = {}
-        cmd = "<show><interface>all</interface></show>"
-
-        self.device.op(cmd=cmd)
-        interface_info_xml = xmltodict.parse(self.device.xml_root())
-        interface_info_json = json.dumps(
-            interface_info_xml["response"]["result"]["ifnet"]["entry"]
-        )
-        interface_info = json.loads(interface_info_json)
+        interface_info = self._get_interfaces_all()["ifnet"]["entry"]
 
         if isinstance(interface_info, dict):
             # Same "1 vs many -> dict vs list of dicts" comment.
@@ -1,5 +1,6 @@
 """Test fixtures."""
 from builtins import super
+from xml.etree import ElementTree
 
 import pytest
 from napalm.base.test import conftest as parent_conftest
@@ -45,6 +46,12 @@ class PatchedDriver(OriginalDriver):
     def is_alive(self):
         return {"is_alive": True}
 
+    def _new_device(self):
+        device = FakeDevice()
+        device.current_test = self.device.current_test
+        device.current_test_case = self.device.current_test_case
+        return device
+
 
 class FakeDevice(BaseTestDouble):
     """Device test double."""
@@ -65,6 +72,13 @@ class FakeDevice(BaseTestDouble):
         xml_string = self.read_txt_file(full_path)
         return xml_string
 
+    @property
+    def element_root(self):
+        return ElementTree.fromstring(self.xml_root())
+
+    def keygen(self):
+        return "fake-api-key"
+
     def op(self, cmd=""):
         self.cmd = cmd
         return True
@@ -0,0 +1,353 @@
+"""Tests for driver behavior not covered by the getter test cases."""
+from datetime import timedelta
+
+import pytest
+from napalm.base.exceptions import MergeConfigException
+from napalm.base.exceptions import ReplaceConfigException
+
+from conftest import PatchedDriver
+from napalm_panos import panos
+
+
+def _patched_driver(current_test, optional_args=None, test_case="normal"):
+    """Return a patched driver serving the mocked data of current_test/test_case."""
+    driver = PatchedDriver("1.2.3.4", "test", "test", optional_args=optional_args)
+    driver.device.current_test = current_test
+    driver.device.current_test_case = test_case
+    return driver
+
+
+def test_get_interfaces_concurrent():
+    """Per-interface queries on worker devices return the sequential result."""
+    driver = _patched_driver("test_get_interfaces", {"interface_workers": 4})
+
+    result = driver.get_interfaces()
+
+    assert result == driver.device.expected_result
+    # No api_key was given, so the workers use a key generated once.
+    assert driver._cached_key == "fake-api-key"
+
+
+class FakeSSHDevice(object):
+    """Netmiko connection test double."""
+
+    def __init__(self, commit_output="Configuration committed successfully"):
+        self.commit_output = commit_output
+
+        self.config_sets = []
+        self.config_mode_exits = 0
+
+    def send_config_set(self, config_commands, **kwargs):
+        self.config_sets.append(config_commands)
+        return ""
+
+    def commit(self):
+        return self.commit_output
+
+    def exit_config_mode(self):
+        self.config_mode_exits += 1
+        return ""
+
+    def send_command(self, command_string, **kwargs):
+        return "diff\n"
+
+    def disconnect(self):
+        pass
+
+
+class FakeClock(object):
+    """Stand-in for the time module, advancing only when sleeping."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+def _record_ops(driver):
+    """Record every command sent through driver.device.op."""
+    ops = []
+    op = driver.device.op
+
+    def recording_op(cmd=""):
+        ops.append(cmd)
+        return op(cmd=cmd)
+
+    driver.device.op = recording_op
+    return ops
+
+
+def _interfaces_all_ops(ops):
+    return [cmd for cmd in ops if cmd == "<show><interface>all</interface></show>"]
+
+
+def test_interface_cache_reused():
+    """With cache_interfaces, the interface table is queried only once."""
+    driver = _patched_driver("test_get_interfaces", {"cache_interfaces": True})
+    ops = _record_ops(driver)
+
+    first = driver.get_interfaces()
+    second = driver.get_interfaces()
+
+    assert first == second
+    assert len(_interfaces_all_ops(ops)) == 1
+
+
+def test_interface_cache_disabled_by_default():
+    """Without cache_interfaces, every call queries the interface table."""
+    driver = _patched_driver("test_get_interfaces")
+    ops = _record_ops(driver)
+
+    driver.get_interfaces()
+    driver.get_interfaces()
+
+    assert len(_interfaces_all_ops(ops)) == 2
+
+
+def test_interface_cache_cleared_on_commit():
+    """commit_config drops the cached interface table."""
+    driver = _patched_driver("test_get_interfaces", {"cache_interfaces": True})
+    driver.get_interfaces()
+    assert driver._iflist_raw_cache is not None
+
+    driver.loaded = True
+    driver.ssh_connection = True
+    driver.ssh_device = FakeSSHDevice()
+    driver.commit_config()
+
+    assert driver._iflist_raw_cache is None
+    assert driver._iflist_cache is None
+
+
+def test_interface_cache_cleared_on_discard():
+    """discard_config drops the cached interface table."""
+    driver = _patched_driver("test_get_interfaces", {"cache_interfaces": True})
+    driver.get_interfaces()
+    assert driver._iflist_raw_cache is not None
+
+    driver.loaded = True
+    driver.backup_file = "config_backup.xml"
+    driver.device.status = "success"
+    driver.discard_config()
+
+    assert driver._iflist_raw_cache is None
+    assert driver._iflist_cache is None
+
+
+JOB_COMMIT_OUTPUT = (
+    "Commit job 42 is in progress. Use Ctrl+C to return to command prompt\n"
+    "...100%Configuration committed successfully"
+)
+JOB_CMD = "<show><jobs><id>42</id></jobs></show>"
+
+
+def _committing_driver(test_case, merge=False):
+    """Return a driver with a loaded config whose commit queues job 42."""
+    driver = _patched_driver("test_commit_job", test_case=test_case)
+    driver.loaded = True
+    driver.merge_config = merge
+    driver.ssh_connection = True
+    driver.ssh_device = FakeSSHDevice(JOB_COMMIT_OUTPUT)
+    return driver
+
+
+def test_commit_waits_for_job(monkeypatch):
+    """commit_config polls the announced job until it is FIN."""
+    monkeypatch.setattr(panos, "time", FakeClock())
+    driver = _committing_driver("ok")
+    ops = _record_ops(driver)
+
+    driver.commit_config()
+
+    assert ops == [JOB_CMD]
+    assert driver.changed is True
+    assert driver.loaded is False
+
+
+def test_commit_without_job_does_not_poll():
+    """Nothing is polled when the commit output announces no job."""
+    driver = _committing_driver("ok")
+    driver.ssh_device = FakeSSHDevice("There are no changes to commit.")
+    ops = _record_ops(driver)
+
+    driver.commit_config()
+
+    assert ops == []
+
+
+@pytest.mark.parametrize(
+    "merge, exception",
+    [(False, ReplaceConfigException), (True, MergeConfigException)],
+)
+def test_commit_job_failed(monkeypatch, merge, exception):
+    """A job finishing with FAIL surfaces as a commit error."""
+    monkeypatch.setattr(panos, "time", FakeClock())
+    driver = _committing_driver("fail", merge=merge)
+
+    with pytest.raises(exception):
+        driver.commit_config()
+    assert driver.changed is False
+
+
+def test_commit_job_timeout(monkeypatch):
+    """A job still running past the driver timeout fails the commit."""
+    clock = FakeClock()
+    monkeypatch.setattr(panos, "time", clock)
+    driver = _committing_driver("pending")
+    ops = _record_ops(driver)
+
+    with pytest.raises(ReplaceConfigException):
+        driver.commit_config()
+
+    assert clock.now >= driver.timeout
+    assert len(ops) == len(clock.sleeps) + 1
+    # Backoff starts at 0.1s, grows by 1.5x and is capped at 2s.
+    assert clock.sleeps[:3] == pytest.approx([0.1, 0.15, 0.225])
+    assert max(clock.sleeps) == 2
+
+
+def test_rollback_waits_for_job(monkeypatch):
+    """rollback polls the commit job of the restored backup."""
+    monkeypatch.setattr(panos, "time", FakeClock())
+    driver = _committing_driver("ok")
+    driver.changed = True
+    driver.backup_file = "config_backup.xml"
+    ops = _record_ops(driver)
+
+    driver.rollback()
+
+    assert ops == ["<load><config><from>config_backup.xml</from></config></load>", JOB_CMD]
+    assert driver.changed is False
+
+
+def test_rollback_job_timeout(monkeypatch):
+    """rollback is not marked done while its commit job never finishes."""
+    clock = FakeClock()
+    monkeypatch.setattr(panos, "time", clock)
+    driver = _committing_driver("pending")
+    driver.changed = True
+    driver.backup_file = "config_backup.xml"
+
+    driver.rollback()
+
+    assert clock.now >= driver.timeout
+    assert driver.changed is True
+
+
+MERGE_CONFIG = "set deviceconfig system hostname panos-test"
+
+
+def _merging_driver():
+    """Return a driver able to load merge candidates and commit them."""
+    driver = _patched_driver("test_backup")
+    driver.device.status = "success"
+    driver.ssh_connection = True
+    driver.ssh_device = FakeSSHDevice()
+    return driver
+
+
+def _save_ops(ops):
+    return [cmd for cmd in ops if cmd.startswith("<save><config>")]
+
+
+def test_backup_reused_after_discard():
+    """A second load right after discard_config reuses the saved backup."""
+    driver = _merging_driver()
+    ops = _record_ops(driver)
+
+    driver.load_merge_candidate(config=MERGE_CONFIG)
+    driver.discard_config()
+    driver.load_merge_candidate(config=MERGE_CONFIG)
+
+    assert len(_save_ops(ops)) == 1
+
+
+def test_backup_saved_again_after_commit():
+    """A commit changes the running config, so the next load saves a new backup."""
+    driver = _merging_driver()
+    ops = _record_ops(driver)
+
+    driver.load_merge_candidate(config=MERGE_CONFIG)
+    driver.commit_config()
+    driver.load_merge_candidate(config=MERGE_CONFIG)
+
+    assert len(_save_ops(ops)) == 2
+
+
+def test_backup_saved_again_when_expired():
+    """A backup older than _BACKUP_MAX_AGE is not reused."""
+    driver = _merging_driver()
+    ops = _record_ops(driver)
+
+    driver.load_merge_candidate(config=MERGE_CONFIG)
+    driver.discard_config()
+    driver._backup_written_at -= timedelta(seconds=driver._BACKUP_MAX_AGE + 1)
+    driver.load_merge_candidate(config=MERGE_CONFIG)
+
+    assert len(_save_ops(ops)) == 2
+
+
+def test_backup_forgotten_after_rollback():
+    """rollback restores the running config, the backup must be taken again."""
+    driver = _merging_driver()
+    driver.load_merge_candidate(config=MERGE_CONFIG)
+    driver.commit_config()
+    driver._save_backup()
+    assert driver._backup_written_at is not None
+
+    driver.rollback()
+
+    assert driver.changed is False
+    assert driver._backup_written_at is None
+
+
+def test_backup_forgotten_on_close():
+    """A backup is never reused across sessions."""
+    driver = _merging_driver()
+    driver.load_merge_candidate(config=MERGE_CONFIG)
+    assert driver._backup_written_at is not None
+
+    # PatchedDriver.close() is a no-op, run the real one.
+    panos.PANOSDriver.close(driver)
+
+    assert driver._backup_written_at is None
+
+
+def test_compare_config_after_open_ssh(monkeypatch):
+    """A fresh SSH session is in operational mode, no exit is sent."""
+    ssh_device = FakeSSHDevice()
+    monkeypatch.setattr(panos, "ConnectHandler", lambda **kwargs: ssh_device)
+    driver = _patched_driver("test_compare_config")
+
+    assert driver.compare_config() == "diff"
+
+    assert driver.ssh_device is ssh_device
+    assert ssh_device.config_mode_exits == 0
+
+
+def test_compare_config_after_merge():
+    """send_config_set leaves config mode on, compare_config exits it once."""
+    driver = _merging_driver()
+    driver.load_merge_candidate(config=MERGE_CONFIG)
+
+    driver.compare_config()
+    driver.compare_config()
+
+    assert driver.ssh_device.config_mode_exits == 1
+
+
+def test_compare_config_after_commit():
+    """netmiko's commit() stays in config mode, compare_config exits it."""
+    driver = _merging_driver()
+    driver.loaded = True
+
+    driver.commit_config()
+    driver.compare_config()
+
+    assert driver.ssh_device.config_mode_exits == 1